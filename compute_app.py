@@ -1,6 +1,6 @@
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
-import base64, os, uuid, tempfile
+import base64, csv, hashlib, json, os, threading, uuid
 from io import BytesIO
 from fontTools.ttLib import TTFont
 
@@ -22,6 +22,21 @@ CORS(app, resources={
     r"/media/*": {"origins": _ALLOWED_ORIGINS},
 })
 
+try:
+    import orjson
+    from flask.json.provider import JSONProvider
+
+    class _OrjsonProvider(JSONProvider):
+        """Serialize jsonify/get_json through orjson when it's installed."""
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj).decode("utf-8")
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = _OrjsonProvider(app)
+except ImportError:
+    pass  # stdlib json is fine, just slower
+
 @app.get("/")
 def health():
     return "OK"
@@ -32,54 +47,106 @@ try:
 except Exception:
     center_compute_lengths = None
 
+# Parsed-font caches: most users re-upload the same font on every request,
+# so key on a digest of the raw bytes and keep a handful of entries.
+_FONT_CACHE_MAX = 8
+_FONT_METRICS_CACHE = {}   # digest -> (units_per_em, cmap, hmtx)
+_IMAGE_FONT_CACHE = {}     # (digest, size_px) -> ImageFont
+
+def _font_digest(font_bytes: bytes) -> bytes:
+    return hashlib.blake2b(font_bytes, digest_size=16).digest()
+
+# One lock for all the caches: gunicorn runs gthread workers, and the bare
+# check-then-pop eviction let two threads race for the same oldest key
+# (the loser's KeyError turned a valid request into a 500). Inserts are
+# cheap, so the shared lock costs nothing measurable.
+_CACHE_LOCK = threading.Lock()
+
+def _cache_put(cache: dict, key, value, max_items: int = _FONT_CACHE_MAX):
+    with _CACHE_LOCK:
+        while len(cache) >= max_items:
+            cache.pop(next(iter(cache)), None)
+        cache[key] = value
+
+def _font_metrics(font_bytes: bytes):
+    key = _font_digest(font_bytes)
+    hit = _FONT_METRICS_CACHE.get(key)
+    if hit is None:
+        font = TTFont(BytesIO(font_bytes))
+        try:
+            hit = (float(font["head"].unitsPerEm), font.getBestCmap() or {}, font["hmtx"].metrics)
+        finally:
+            try: font.close()
+            except Exception: pass
+        _cache_put(_FONT_METRICS_CACHE, key, hit)
+    return hit
+
+def _image_font(font_bytes: bytes, size_px: int):
+    key = (_font_digest(font_bytes), size_px)
+    hit = _IMAGE_FONT_CACHE.get(key)
+    if hit is None:
+        hit = ImageFont.truetype(BytesIO(font_bytes), size=size_px)
+        _cache_put(_IMAGE_FONT_CACHE, key, hit)
+    return hit
+
 def compute_lengths_fallback(font_bytes: bytes, text: str, height_mm: float):
-    font = TTFont(BytesIO(font_bytes))
-    try:
-        units_per_em = float(font["head"].unitsPerEm)
-        cmap = font.getBestCmap() or {}
-        hmtx = font["hmtx"].metrics
-        scale = float(height_mm) / units_per_em
-        per_letter, total_units = {}, 0
-        for ch in text:
-            glyph = cmap.get(ord(ch), ".notdef")
-            adv = hmtx.get(glyph, (units_per_em, 0))[0]
-            per_letter[ch] = float(adv * scale)
-            total_units += adv
-        return per_letter, float(total_units * scale)
-    finally:
-        try: font.close()
-        except Exception: pass
+    units_per_em, cmap, hmtx = _font_metrics(font_bytes)
+    scale = float(height_mm) / units_per_em
+    # look up each distinct glyph once; repeats are a dict hit
+    adv_units = {}
+    for ch in set(text):
+        glyph = cmap.get(ord(ch), ".notdef")
+        adv_units[ch] = hmtx.get(glyph, (units_per_em, 0))[0]
+    per_letter = {ch: float(adv * scale) for ch, adv in adv_units.items()}
+    total_units = sum(adv_units[ch] for ch in text)
+    return per_letter, float(total_units * scale)
 
 USE_SIMPLE_METRICS = os.getenv("USE_SIMPLE_METRICS", "1") == "1"
 
+# Quoting the same sign repeatedly is the common case — remember recent
+# results keyed by font digest + text + height.
+_LENGTHS_CACHE_MAX = 64
+_LENGTHS_CACHE = {}  # (digest, text, height_mm) -> (per_letter, total)
+
 def compute_lengths_dispatch(font_bytes: bytes, text: str, height_mm: float):
+    key = (_font_digest(font_bytes), text, float(height_mm))
+    hit = _LENGTHS_CACHE.get(key)
+    if hit is not None:
+        return hit
     if not USE_SIMPLE_METRICS and center_compute_lengths is not None:
         try:
-            return center_compute_lengths(font_bytes, text, height_mm)
+            result = center_compute_lengths(font_bytes, text, height_mm)
+            _cache_put(_LENGTHS_CACHE, key, result, _LENGTHS_CACHE_MAX)
+            return result
         except Exception:
             pass
-    return compute_lengths_fallback(font_bytes, text, height_mm)
+    result = compute_lengths_fallback(font_bytes, text, height_mm)
+    _cache_put(_LENGTHS_CACHE, key, result, _LENGTHS_CACHE_MAX)
+    return result
 
 # ---------- SVG QA (outline + skeleton) ----------
 EXPORT_DIR = os.getenv("EXPORT_DIR", "/home/vpsenrom/wiring/exports")
 os.makedirs(EXPORT_DIR, exist_ok=True)
 PX_PER_MM = float(os.getenv("PX_PER_MM", "10"))
 
+_SPACE_TABLE = str.maketrans({" ": "␣"})
+
 def _safe_piece(s: str) -> str:
     s = "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in str(s))
     return s.strip("_") or "file"
 
+# CSV/XLS(X) download by default; SVG downloads only when ?dl=1
+_ATTACHMENT_EXTS = {".csv", ".xlsx", ".xls"}
+
 @app.get("/media/<job_id>/<path:filename>")
 def media(job_id, filename):
-    from flask import request  # ensure imported at top if not already
     job_id = _safe_piece(job_id)
     filename = _safe_piece(filename)
     job_path = os.path.join(EXPORT_DIR, job_id)
 
     ext = os.path.splitext(filename)[1].lower()
     force_dl = request.args.get("dl") == "1"
-    # CSV/XLS(X) download by default; SVG downloads only when ?dl=1
-    as_attachment = force_dl or (ext in {".csv", ".xlsx", ".xls"})
+    as_attachment = force_dl or (ext in _ATTACHMENT_EXTS)
 
     return send_from_directory(
         job_path,
@@ -91,24 +158,19 @@ def media(job_id, filename):
 
 def _render_text_mask(font_bytes: bytes, text: str, height_mm: float):
     height_px = max(64, int(height_mm * PX_PER_MM))
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".ttf") as tf:
-        tf.write(font_bytes); tmp_path = tf.name
-    try:
-        font = ImageFont.truetype(tmp_path, size=height_px)
-        dummy = Image.new("L", (1, 1), 0)
-        d0 = ImageDraw.Draw(dummy)
-        x0, y0, x1, y1 = d0.textbbox((0, 0), text, font=font)
-        w, h = max(1, x1 - x0), max(1, y1 - y0)
-        pad = int(max(6, height_px * 0.06))
-        W, H = w + 2 * pad, h + 2 * pad
-        img = Image.new("L", (W, H), 0)
-        ImageDraw.Draw(img).text((pad - x0, pad - y0), text, font=font, fill=255)
-        arr = (np.array(img) > 0)
-        mm_per_px = height_mm / float(height_px)
-        return arr, (W, H), mm_per_px
-    finally:
-        try: os.remove(tmp_path)
-        except Exception: pass
+    font = _image_font(font_bytes, height_px)
+    dummy = Image.new("L", (1, 1), 0)
+    d0 = ImageDraw.Draw(dummy)
+    x0, y0, x1, y1 = d0.textbbox((0, 0), text, font=font)
+    w, h = max(1, x1 - x0), max(1, y1 - y0)
+    pad = int(max(6, height_px * 0.06))
+    W, H = w + 2 * pad, h + 2 * pad
+    img = Image.new("L", (W, H), 0)
+    ImageDraw.Draw(img).text((pad - x0, pad - y0), text, font=font, fill=255)
+    # frombuffer over tobytes skips Pillow's generic array-protocol dispatch
+    arr = np.frombuffer(img.tobytes(), dtype=np.uint8).reshape(H, W) > 0
+    mm_per_px = height_mm / float(height_px)
+    return arr, (W, H), mm_per_px
 
 def _length_from_skeleton_bool(A: np.ndarray, mm_per_px: float) -> float:
     e_down  = (A & np.roll(A, -1, axis=0)).sum()
@@ -119,29 +181,46 @@ def _length_from_skeleton_bool(A: np.ndarray, mm_per_px: float) -> float:
     return float(length_px * mm_per_px)
 
 def _draw_outline_paths(dwg, mask: np.ndarray):
-    for c in find_contours(mask.astype(float), 0.5):
+    # view as uint8 rather than copying the whole raster to float64
+    for c in find_contours(mask.view(np.uint8), 0.5):
         if len(c) < 2: continue
-        pts = [(float(x), float(y)) for y, x in c]
-        path = "M " + " L ".join(f"{x:.2f},{y:.2f}" for x, y in pts)
+        pts = np.char.mod("%.2f", c[:, ::-1])  # (row, col) -> "x", "y"
+        path = "M " + " L ".join(np.char.add(np.char.add(pts[:, 0], ","), pts[:, 1]).tolist())
         dwg.add(dwg.path(d=path, fill="none", stroke="black", stroke_width=1))
 
 def _draw_skeleton_points(dwg, skel: np.ndarray):
     ys, xs = np.where(skel)
-    for x, y in zip(xs, ys):
-        dwg.add(dwg.circle(center=(float(x), float(y)), r=0.35, fill="red"))
+    if not len(xs):
+        return
+    # One <path> of tiny dashes instead of thousands of <circle> elements
+    d = " ".join(f"M{x:.1f} {y:.1f}h.1" for x, y in zip(xs.tolist(), ys.tolist()))
+    dwg.add(dwg.path(d=d, stroke="red", stroke_width=0.7,
+                     stroke_linecap="round", fill="none"))
 
 def export_letter_svgs(font_bytes: bytes, text: str, height_mm: float, job_dir: str):
     files, lengths_mm = [], []
+    # One FreeType render for the whole word; each letter is cropped out of it
+    # at its advance-width x-split instead of being re-rendered on its own.
+    mask, (W, H), mm_per_px = _render_text_mask(font_bytes, text, height_mm)
+    height_px = max(64, int(height_mm * PX_PER_MM))
+    font = _image_font(font_bytes, height_px)
+    x0 = ImageDraw.Draw(Image.new("L", (1, 1), 0)).textbbox((0, 0), text, font=font)[0]
+    origin = int(max(6, height_px * 0.06)) - x0  # same pad as _render_text_mask
     for i, ch in enumerate(text, start=1):
         if ch == " ":
             lengths_mm.append(0.0); continue
-        mask, (W, H), mm_per_px = _render_text_mask(font_bytes, ch, height_mm)
-        skel = skeletonize(mask)
+        xs = max(0, origin + int(font.getlength(text[:i - 1])))
+        xe = min(W, origin + int(font.getlength(text[:i])))
+        if xe <= xs:
+            lengths_mm.append(0.0); continue
+        letter_mask = np.ascontiguousarray(mask[:, xs:xe])
+        skel = skeletonize(letter_mask, method="lee").astype(bool)
         Lmm = _length_from_skeleton_bool(skel, mm_per_px)
         svg_name = f"{i:02d}_{_safe_piece(ch)}.svg"
         svg_path = os.path.join(job_dir, svg_name)
-        dwg = svgwrite.Drawing(svg_path, size=(f"{W}px", f"{H}px"), viewBox=f"0 0 {W} {H}")
-        _draw_outline_paths(dwg, mask)
+        w = xe - xs
+        dwg = svgwrite.Drawing(svg_path, size=(f"{w}px", f"{H}px"), viewBox=f"0 0 {w} {H}")
+        _draw_outline_paths(dwg, letter_mask)
         _draw_skeleton_points(dwg, skel)
         dwg.save()
         files.append((ch, svg_name)); lengths_mm.append(Lmm)
@@ -149,7 +228,7 @@ def export_letter_svgs(font_bytes: bytes, text: str, height_mm: float, job_dir:
 
 def export_word_svg(font_bytes: bytes, text: str, height_mm: float, job_dir: str):
     mask, (W, H), mm_per_px = _render_text_mask(font_bytes, text, height_mm)
-    skel = skeletonize(mask)
+    skel = skeletonize(mask, method="lee").astype(bool)
     Lmm = _length_from_skeleton_bool(skel, mm_per_px)
     svg_name = f"{_safe_piece(text)}_word.svg"
     svg_path = os.path.join(job_dir, svg_name)
@@ -161,7 +240,21 @@ def export_word_svg(font_bytes: bytes, text: str, height_mm: float, job_dir: str
 
 @app.post("/run")
 def run():
-    data = request.get_json(force=True) or {}
+    # Preferred: multipart upload with the font as a file field and the rest
+    # of the request as a JSON "payload" form field — no base64 inflation.
+    # JSON with font_b64 is still accepted for older clients.
+    font_file = request.files.get("font")
+    if font_file is not None:
+        try:
+            data = json.loads(request.form.get("payload") or "{}") or {}
+        except ValueError as e:
+            return jsonify({"ok": False, "error": f"Invalid payload JSON: {e}"}), 400
+        if not isinstance(data, dict):
+            return jsonify({"ok": False, "error": "Invalid payload JSON: expected an object"}), 400
+        font_bytes = font_file.read()
+    else:
+        data = request.get_json(force=True) or {}
+        font_bytes = None
     text = (data.get("text") or "").strip()
     font_b64 = data.get("font_b64") or ""
     export_svg       = bool(data.get("export_svg") or False)
@@ -182,17 +275,21 @@ def run():
     except (TypeError, ValueError):
         height_mm = 100.0
 
-    if not text or not font_b64:
+    if not text or not (font_bytes or font_b64):
         return jsonify({"ok": False, "error": "Missing text or font"}), 400
 
-    try:
-        font_bytes = base64.b64decode(font_b64)
-    except Exception as e:
-        return jsonify({"ok": False, "error": f"Invalid font_b64: {e}"}), 400
+    if font_bytes is None:
+        try:
+            font_bytes = base64.b64decode(font_b64)
+        except Exception as e:
+            return jsonify({"ok": False, "error": f"Invalid font_b64: {e}"}), 400
 
     try:
         per_letter, total_len = compute_lengths_dispatch(font_bytes, text, height_mm)
-        per_letter = {k: round(float(v), 2) for k, v in per_letter.items()}
+        # round all values in one vectorized pass
+        per_letter = dict(zip(per_letter.keys(),
+                              np.round(np.fromiter(per_letter.values(), np.float64,
+                                                   count=len(per_letter)), 2).tolist()))
         total_len = round(float(total_len), 2)
         resp = {"ok": True, "per_letter": per_letter, "total_length_mm": total_len}
 
@@ -206,7 +303,7 @@ def run():
                 files, letter_visual_lengths = export_letter_svgs(font_bytes, text, height_mm, job_dir)
                 resp["job_id"] = job_id
                 resp["svg_urls"] = [{"letter": ch, "url": f"/media/{job_id}/{name}"} for ch, name in files]
-                resp["visual_per_letter"] = [round(v, 2) for v in letter_visual_lengths]
+                resp["visual_per_letter"] = np.round(np.asarray(letter_visual_lengths), 2).tolist()
 
             if export_word_svg_:
                 word_name, word_visual_mm = export_word_svg(font_bytes, text, height_mm, job_dir)
@@ -215,51 +312,75 @@ def run():
                 resp["word_visual_length_mm"] = round(float(word_visual_mm), 2)
 
             if export_report:
-                letters = []
-                lengths = []
-                for ch in text:
-                    letters.append("␣" if ch == " " else ch)
-                    lengths.append(float(per_letter.get(ch, 0.0)))
-
-                df_cols = {"Letter": letters, "Length (mm)": lengths}
-                total_word_len = float(sum(lengths))
-
-                if (led_pm is not None) and (fab_mm is not None):
-                    led_costs = [(L / 1000.0) * led_pm for L in lengths]
-                    fab_costs = [L * fab_mm for L in lengths]
-                    tot_costs = [lc + fc for lc, fc in zip(led_costs, fab_costs)]
-                    df_cols[f"LED Cost ({currency or ''})"] = led_costs
-                    df_cols[f"Total Cost ({currency or ''})"] = tot_costs
-                    total_led = sum(led_costs)
-                    total_fab = sum(fab_costs)
-                    total_word_cost = total_led + total_fab
+                # xlsx goes through openpyxl (slow, pure-Python XML) — only
+                # produce it when the caller lists it in report.formats.
+                formats = {str(f).lower() for f in (report_cfg.get("formats") or ["csv"])}
+                want_xlsx = "xlsx" in formats
+
+                letters = text.translate(_SPACE_TABLE)
+                lengths_arr = np.fromiter((per_letter.get(ch, 0.0) for ch in text),
+                                          dtype=np.float64, count=len(text))
+                lengths = lengths_arr.tolist()
+
+                total_word_len = float(lengths_arr.sum())
+                have_costs = (led_pm is not None) and (fab_mm is not None)
+
+                if have_costs:
+                    # one C-level pass per column instead of a scalar Python loop
+                    led_arr = lengths_arr * (led_pm / 1000.0)
+                    tot_arr = led_arr + lengths_arr * fab_mm
+                    led_costs = led_arr.tolist()
+                    tot_costs = tot_arr.tolist()
+                    total_led = float(led_arr.sum())
+                    total_word_cost = float(tot_arr.sum())
                     job_total = total_word_cost + (setup or 0.0)
                 else:
-                    total_led = total_fab = total_word_cost = job_total = None
+                    total_led = total_word_cost = job_total = None
 
-                df = pd.DataFrame(df_cols)
-                tw_row = {"Letter": "TOTAL WORD", "Length (mm)": total_word_len}
+                header = ["Letter", "Length (mm)"]
+                if have_costs:
+                    header += [f"LED Cost ({currency or ''})", f"Total Cost ({currency or ''})"]
+                if export_word_svg_:
+                    header.append("Word SVG")
+
+                rows = []
+                for i, (ch, L) in enumerate(zip(letters, lengths)):
+                    row = [ch, L]
+                    if have_costs:
+                        row += [led_costs[i], tot_costs[i]]
+                    if export_word_svg_:
+                        row.append("")
+                    rows.append(row)
+
+                tw_row = ["TOTAL WORD", total_word_len]
+                if have_costs:
+                    tw_row += [total_led, total_word_cost]
                 if export_word_svg_:
-                    tw_row["Word SVG"] = f"/media/{job_id}/{_safe_piece(text)}_word.svg"
-                if total_led is not None:
-                    tw_row[f"LED Cost ({currency or ''})"] = total_led
-                    tw_row[f"Total Cost ({currency or ''})"] = total_word_cost
-                df.loc[len(df.index)] = tw_row
+                    tw_row.append(f"/media/{job_id}/{_safe_piece(text)}_word.svg")
+                rows.append(tw_row)
                 if job_total is not None:
-                    jt_row = {"Letter": "JOB TOTAL", f"Total Cost ({currency or ''})": job_total}
-                    df.loc[len(df.index)] = jt_row
+                    jt_row = ["JOB TOTAL", "", "", job_total]
+                    if export_word_svg_:
+                        jt_row.append("")
+                    rows.append(jt_row)
+
+                csv_name = f"{_safe_piece(text)}_lengths.csv"
+                csv_path = os.path.join(job_dir, csv_name)
+                with open(csv_path, "w", newline="") as f:
+                    w = csv.writer(f)
+                    w.writerow(header)
+                    w.writerows(rows)
+                urls = {"csv": f"/media/{job_id}/{csv_name}"}
 
-                csv_name  = f"{_safe_piece(text)}_lengths.csv"
-                xlsx_name = f"{_safe_piece(text)}_lengths.xlsx"
-                csv_path  = os.path.join(job_dir, csv_name)
-                xlsx_path = os.path.join(job_dir, xlsx_name)
-                df.to_csv(csv_path, index=False)
-                try: df.to_excel(xlsx_path, index=False)
-                except Exception: xlsx_name = None
+                if want_xlsx:
+                    xlsx_name = f"{_safe_piece(text)}_lengths.xlsx"
+                    xlsx_path = os.path.join(job_dir, xlsx_name)
+                    try:
+                        pd.DataFrame(rows, columns=header).to_excel(xlsx_path, index=False)
+                        urls["xlsx"] = f"/media/{job_id}/{xlsx_name}"
+                    except Exception:
+                        pass
 
-                urls = {"csv": f"/media/{job_id}/{csv_name}"}
-                if xlsx_name:
-                    urls["xlsx"] = f"/media/{job_id}/{xlsx_name}"
                 resp["job_id"] = job_id
                 resp["report_urls"] = urls
 
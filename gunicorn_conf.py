@@ -0,0 +1,6 @@
+# Threaded workers: the hot kernels (numpy, PIL, skimage) release the GIL,
+# so concurrent /run requests overlap instead of queuing behind one request.
+workers = 2
+threads = 4
+worker_class = "gthread"
+timeout = 240